@@ -16,58 +16,67 @@
 # Based on https://github.com/deepmind/dm-haiku/blob/4ae60fd4fd2da3b2f8f9ad3ec6dfd893745b483b/examples/mnist_gan.ipynb
 
 import functools
+import os
 from typing import Any, NamedTuple
 
 import haiku as hk
 import jax
+import jmp
 import optax
 import jax.numpy as jnp
+import numpy as np
 
 from haiku.nets import MLP
 import jax.nn as nn
 
+import chex
 from chex import assert_shape, assert_equal_shape
 
-# Uncomment to disable asserts
-# chex.disable_asserts()
+# Asserts are disabled by default, set TPAL_FAST=0 to enable them
+if os.environ.get("TPAL_FAST", "1") == "1":
+    chex.disable_asserts()
 
-# Model
-class BidSampler:
-    def __init__(self, rng, bidders, items):
-        self.bidders = bidders
-        self.items = items
+# Mixed precision: parameters and outputs in float32, compute in bfloat16.
+mp_policy = jmp.Policy(
+    param_dtype=jnp.float32, compute_dtype=jnp.bfloat16, output_dtype=jnp.float32
+)
 
-        self.key = rng
 
-    def sample(self, num_samples):
-        self.key, self.subkey = jax.random.split(self.key)
+class MixedPrecisionMLP(MLP):
+    """MLP computed under the mixed precision policy."""
+
+
+hk.mixed_precision.set_policy(MixedPrecisionMLP, mp_policy)
+
+
+# Model
+class BidSampler:
+    @staticmethod
+    def sample(key, num_samples, bidders, items):
+        """Samples a batch of uniform [0,1] valuation profiles."""
+        return jax.random.uniform(key, (num_samples, bidders, items))
 
-        sample = jnp.stack(
-            [
-                jax.random.uniform(self.subkey, (self.bidders, self.items))
-                for _ in range(0, num_samples)
-            ],
-            axis=0,
-        )
-        return sample
 
+# index matrix moving b_i to the front of B, one row per bidder i
+# B[idx[i]] = [b_i, b_0, ..., b_i-1, b_i+1, ..., b_n]
+# NOTE: computed with NumPy on the host, so it enters the graph as a constant
+def bidder_permutations(bidders):
+    i = np.arange(bidders)[:, None]
+    j = np.arange(bidders)[None, :]
+    # column 0 is b_i, column j > 0 is b_j-1 up to b_i and b_j after it
+    return np.where(j == 0, i, j - (j <= i))
 
-# move b_i to the front of B
-# B = [b_i, b_0, ..., b_i-1, b_i+1, ..., b_n]
-def permute_along_bidders(B, i):
-    head = B[:, 0:i]  # all bid profiles up to b_i
-    tail = B[:, i + 1 :]  # all bid profiles after b_i
-    b_i = B[:, i : i + 1]  # b_i, slice this way to preserve shape
-    permuted = jnp.concatenate([b_i, head, tail], axis=1)
 
-    assert_equal_shape([B, permuted])
-    return permuted
+# gather all bidder permutations of a batch B, one raveled bid profile per row
+def permute_along_bidders(B, perm_idx):
+    permuted = jnp.take(B, perm_idx, axis=1)
+    return jnp.reshape(permuted, (B.shape[0], perm_idx.shape[0], -1))
 
 
 class Auctioneer(hk.Module):
     """Auctioneer network."""
 
-    def __init__(self, bidders, items, net_width, net_depth, name=None):
+    def __init__(self, bidders, items, net_width, net_depth, perm_idx, name=None):
         super().__init__(name=name)
         self.bidders = bidders
         self.items = items
@@ -75,72 +84,72 @@ class Auctioneer(hk.Module):
         self.net_depth = net_depth
 
         self.layers = [self.bidders * self.items, self.net_width, self.net_depth]
-        self.layers_alloc = [*self.layers, self.items]
-        self.layers_pay = [*self.layers, 1]
 
-        # Initialize MLPs
-        self.alloc_prob = MLP(self.layers_alloc, activation=jnp.tanh)
-        self.alloc_which = MLP(self.layers_alloc, activation=jnp.tanh)
-        self.pay_mlp = MLP(self.layers_pay, activation=jnp.tanh)
+        # Initialize the shared MLP trunk, heads are split at the last layer
+        self.trunk = MixedPrecisionMLP(
+            self.layers, activation=jnp.tanh, activate_final=True
+        )
+        self.alloc_prob = hk.Linear(self.items, name="alloc_prob")
+        self.alloc_which = hk.Linear(self.items, name="alloc_which")
+        self.pay_head = hk.Linear(1, name="pay_head")
+
+        self.perm_idx = perm_idx
 
     def __call__(self, vals):
-        """Computes auctions, consisting of an allocation and a payment matrix."""
+        """Computes auctions, consisting of an allocation and a payment matrix.
+
+        Also returns the value of the allocation to each bidder under the bids.
+        """
 
+        # first axis is the batch
         # rows are bidders
         # columns are items
+        batch = vals.shape[0]
+        assert_shape(vals, (batch, self.bidders, self.items))
+
+        # all bidder permutations of the bid profiles, one per row
+        permuted = permute_along_bidders(vals, self.perm_idx)
+        assert_shape(permuted, (batch, self.bidders, self.bidders * self.items))
+
+        # compute trunk features for all bid profiles and permutations at once
+        features = self.trunk(permuted)
 
         # probability to allocate an item
-        alloc = self.alloc_prob(jnp.ravel(vals))
-        alloc = nn.sigmoid(alloc)
-        assert_shape(alloc, (self.items,))
+        # NOTE: the first permutation is the identity, i.e. the raveled vals
+        alloc_prob = self.alloc_prob(features[:, 0])
+        alloc_prob = nn.sigmoid(alloc_prob)
+        assert_shape(alloc_prob, (batch, self.items))
 
         # probability to allocate item j to bidder i
-        L = jnp.stack(  # stack bidder vectors to get matrix
-            # compute bidder vectors
-            [
-                self.alloc_which(jnp.ravel(permute_along_bidders(vals, i)))
-                for i in range(self.bidders)
-            ],
-            axis=0,
-        )
+        L = self.alloc_which(features)
 
         # softmax to ensure feasibility (allocate every item at most once).
-        L = nn.softmax(L, axis=0)
-        assert_shape(L, (self.bidders, self.items))
-
-        alloc = alloc * L
-        assert_shape(alloc, (self.bidders, self.items))
+        L = nn.softmax(L, axis=1)
+        assert_shape(L, (batch, self.bidders, self.items))
 
-        # fraction of utility each bidder pays to the mechanism
-        pay = jnp.squeeze(
-            jnp.stack(
-                [
-                    nn.sigmoid(self.pay_mlp(jnp.ravel(permute_along_bidders(vals, i))))
-                    for i in range(self.bidders)
-                ],
-                axis=1,
-            )
-        )
+        alloc = alloc_prob[:, None, :] * L
+        assert_shape(alloc, (batch, self.bidders, self.items))
 
-        # Fix shape for single bidder case.
-        if self.bidders == 1:
-            pay = jnp.stack([pay])
+        # sum of allocations of all items per bidder for a given bid profile,
+        # in one expression so the gate, softmax and reduction fuse
+        value = jnp.sum(vals * alloc_prob[:, None, :] * L, axis=-1)
+        assert_shape(value, (batch, self.bidders))
 
-        assert_shape(pay, (self.bidders,))
+        # fraction of utility each bidder pays to the mechanism
+        pay = jnp.reshape(nn.sigmoid(self.pay_head(features)), (batch, self.bidders))
+        assert_shape(pay, (batch, self.bidders))
 
         # fractions of utilities * sum of allocations of all items
-        # per bidder for a given bid profile
-        pay = pay * jnp.sum(jnp.squeeze(vals) * alloc, axis=1)
-        # NOTE: squeeze vals, since they are in a batch of size one
+        pay = pay * value
 
-        assert_shape(pay, (self.bidders,))
-        return alloc, pay
+        assert_shape(pay, (batch, self.bidders))
+        return alloc, pay, value
 
 
 class Misreporter(hk.Module):
     """Misreporter network."""
 
-    def __init__(self, bidders, items, net_width, net_depth, name=None):
+    def __init__(self, bidders, items, net_width, net_depth, perm_idx, name=None):
         super().__init__(name=name)
         self.bidders = bidders
         self.items = items
@@ -155,19 +164,22 @@ class Misreporter(hk.Module):
         ]
 
         # Initialize MLP
-        self.misr_mlp = MLP(self.layers, activation=jnp.tanh)
+        self.misr_mlp = MixedPrecisionMLP(self.layers, activation=jnp.tanh)
+
+        self.perm_idx = perm_idx
 
     def __call__(self, vals):
         """Computes (approximately) optimal misreports for a given auction."""
 
-        # TODO: JAXize more?
-        m_ = []
-        for i in range(self.bidders):
-            misr = self.misr_mlp(jnp.ravel(permute_along_bidders(vals, i)))
-            m_.append(misr)
+        batch = vals.shape[0]
+        assert_shape(vals, (batch, self.bidders, self.items))
+
+        # all bidder permutations of the bid profiles, one per row
+        permuted = permute_along_bidders(vals, self.perm_idx)
+        assert_shape(permuted, (batch, self.bidders, self.bidders * self.items))
 
-        misreports = jnp.stack(m_)
-        assert_shape(misreports, (self.bidders, self.items))
+        misreports = self.misr_mlp(permuted)
+        assert_shape(misreports, (batch, self.bidders, self.items))
 
         # NOTE: sigmoid for [0,1] valuations, should be e.g. softplus for positive valuations
         misreports = nn.sigmoid(misreports)
@@ -175,7 +187,7 @@ class Misreporter(hk.Module):
 
 
 def tree_shape(xs):
-    return jax.tree_map(lambda x: x.shape, xs)
+    return jax.tree_util.tree_map(lambda x: x.shape, xs)
 
 
 class TPALTuple(NamedTuple):
@@ -198,12 +210,19 @@ class TPAL:
         self.net_width = net_width
         self.net_depth = net_depth
 
+        # Static index of all bidder permutations, shared by both networks.
+        self.perm_idx = bidder_permutations(self.bidders)
+
         # Define the Haiku network transforms.
         # We don't use BatchNorm so we don't use `with_state`.
         self.auct_transform = hk.without_apply_rng(
             hk.transform(
                 lambda *args: Auctioneer(
-                    self.bidders, self.items, self.net_width, self.net_depth
+                    self.bidders,
+                    self.items,
+                    self.net_width,
+                    self.net_depth,
+                    self.perm_idx,
                 )(*args)
             )
         )
@@ -211,11 +230,19 @@ class TPAL:
         self.misr_transform = hk.without_apply_rng(
             hk.transform(
                 lambda *args: Misreporter(
-                    self.bidders, self.items, self.net_width, self.net_depth
+                    self.bidders,
+                    self.items,
+                    self.net_width,
+                    self.net_depth,
+                    self.perm_idx,
                 )(*args)
             )
         )
 
+        # Jitted apply functions, used by all internal methods.
+        self._auct_apply = jax.jit(self.auct_transform.apply)
+        self._misr_apply = jax.jit(self.misr_transform.apply)
+
         # Build the optimizers.
         self.optimizers = TPALTuple(
             # try 1e-2/1e-3, b1, b2 are defaults
@@ -234,9 +261,6 @@ class TPAL:
             misr=self.misr_transform.init(rng_misr, vals),
         )
 
-        print("Auctioneer: \n\n{}\n".format(tree_shape(params.auct)))
-        print("Misreporter: \n\n{}\n".format(tree_shape(params.misr)))
-
         # Initialize the optimizers.
         opt_state = TPALTuple(
             auct=self.optimizers.auct.init(params.auct),
@@ -265,7 +289,7 @@ class TPAL:
 
     # Calculate utilities for all players
     def utility(self, vals, alloc, pay):
-        utilities = jnp.sum(jnp.squeeze(vals) * alloc, axis=1) - pay
+        utilities = jnp.sum(vals * alloc, axis=-1) - pay
 
         assert_equal_shape([utilities, pay])
         return utilities
@@ -274,51 +298,56 @@ class TPAL:
     def utility_i(self, vals, i, alloc, pay):
         return jnp.sum(alloc[i] * vals[i]) - pay[i]
 
-    # Take misreports of bidder i while keeping the rest fixed
-    def misr_bidder_i(self, vals, misrs, i):
-        head = vals[:, 0:i]  # all bid profiles up to V_i
-        tail = vals[:, i + 1 :]  # all bid profiles after V_i
-        m_i = misrs[
-            :, i : i + 1
-        ]  # misreports of bidder i, slice this way to preserve shape
-        V_minus_i = jnp.concatenate([head, m_i, tail], axis=1)
+    # Take misreports of bidder i while keeping the rest fixed, for all i
+    # V[:, i] = [v_0, ..., v_i-1, m_i, v_i+1, ..., v_n]
+    def misr_bidders(self, vals, misrs):
+        batch = vals.shape[0]
+        bidder = jnp.arange(self.bidders)
+        V = jnp.where(
+            (bidder[:, None] == bidder[None, :])[None, :, :, None],
+            misrs[:, None, :, :],
+            vals[:, None, :, :],
+        )
 
-        assert_equal_shape([vals, V_minus_i])
-        return V_minus_i
+        assert_shape(V, (batch, self.bidders, self.bidders, self.items))
+        return V
 
     def misr_utility(self, misreports, val_sample, auct_params):
-        # TODO: JAXize more?
-        misr_utils = []
-        for i in range(0, self.bidders):
-            misr_i = self.misr_bidder_i(val_sample, misreports, i)
-            assert_shape(misr_i, (self.bidders, self.items))
-
-            # Receive an auction for misr_i
-            alloc_m, pay_m = self.auct_transform.apply(auct_params, misr_i)
-
-            u_i = self.utility(val_sample, alloc_m, pay_m)
-            u_i = u_i[i]
-            assert_shape(u_i, ())
+        batch = val_sample.shape[0]
+        misr = self.misr_bidders(val_sample, misreports)
 
-            misr_utils.append(u_i)
-
-        u_misr = jnp.stack(misr_utils)
+        # Receive auctions for all misr_i of all bid profiles at once
+        alloc_m, pay_m, _ = self._auct_apply(
+            auct_params,
+            jnp.reshape(misr, (batch * self.bidders, self.bidders, self.items)),
+        )
+        alloc_m = jnp.reshape(alloc_m, (batch, self.bidders, self.bidders, self.items))
+        pay_m = jnp.reshape(pay_m, (batch, self.bidders, self.bidders))
+
+        # utility of bidder i in the auction for misr_i
+        bidder = jnp.arange(self.bidders)
+        u_misr = (
+            jnp.sum(val_sample * alloc_m[:, bidder, bidder], axis=-1)
+            - pay_m[:, bidder, bidder]
+        )
+        assert_shape(u_misr, (batch, self.bidders))
         return u_misr
 
     def auct_loss(self, auct_params, misr_params, val_sample):
         """Auctioneer loss."""
 
         # Receive an auction
-        alloc, pay = self.auct_transform.apply(auct_params, val_sample)
+        _, pay, value = self._auct_apply(auct_params, val_sample)
         # Receive misreports
-        misreports = self.misr_transform.apply(misr_params, val_sample)
+        misreports = self._misr_apply(misr_params, val_sample)
 
         regret = nn.relu(
-            self.misr_utility(misreports, val_sample, auct_params)
-            - self.utility(val_sample, alloc, pay)
+            self.misr_utility(misreports, val_sample, auct_params) - (value - pay)
         )
 
-        loss = -(jnp.sqrt(jnp.sum(pay)) - jnp.sqrt(jnp.sum(regret))) + jnp.sum(regret)
+        pay = jnp.sum(pay, axis=-1)
+        regret = jnp.sum(regret, axis=-1)
+        loss = -(jnp.sqrt(pay) - jnp.sqrt(regret)) + regret
 
         return loss
 
@@ -326,23 +355,21 @@ class TPAL:
         """Misreporter loss."""
 
         # Receive misreports
-        misreports = self.misr_transform.apply(misr_params, val_sample)
+        misreports = self._misr_apply(misr_params, val_sample)
 
         # Calculate utility for misreports
         u_misr = self.misr_utility(misreports, val_sample, auct_params)
 
-        return -jnp.sum(u_misr)
+        return -jnp.sum(u_misr, axis=-1)
 
-    # Vectorize losses to use on batches
+    # Average losses over batches
     def v_auct_loss(self, auct_params, misr_params, val_batch):
-        v_al = jax.vmap(functools.partial(self.auct_loss, auct_params, misr_params))
-        return jnp.mean(v_al(val_batch))
+        return jnp.mean(self.auct_loss(auct_params, misr_params, val_batch))
 
     def v_misr_loss(self, misr_params, auct_params, val_batch):
-        v_ml = jax.vmap(functools.partial(self.misr_loss, misr_params, auct_params))
-        return jnp.mean(v_ml(val_batch))
+        return jnp.mean(self.misr_loss(misr_params, auct_params, val_batch))
 
-    @functools.partial(jax.jit, static_argnums=0)
+    @functools.partial(jax.jit, static_argnums=0, donate_argnums=(1,))
     def update_auct(self, tpal_state, batch):
         """Performs a parameter update."""
         # Update the generator.
@@ -362,18 +389,27 @@ class TPAL:
         }
         return tpal_state, log
 
-    @functools.partial(jax.jit, static_argnums=0)
-    def update_misr(self, tpal_state, batch):
-        """Performs a parameter update."""
+    def _misr_update(self, misr_params, misr_opt_state, auct_params, batch):
         # Update the misreporter.
         misr_loss, misr_grads = jax.value_and_grad(self.v_misr_loss)(
-            tpal_state.params.misr, tpal_state.params.auct, batch
+            misr_params, auct_params, batch
         )  # NOTE: Params of the network to be updated need to be the first arg.
 
         misr_update, misr_opt_state = self.optimizers.misr.update(
-            misr_grads, tpal_state.opt_state.misr, tpal_state.params.misr
+            misr_grads, misr_opt_state, misr_params
+        )
+        misr_params = optax.apply_updates(misr_params, misr_update)
+        return misr_params, misr_opt_state, misr_loss
+
+    @functools.partial(jax.jit, static_argnums=0, donate_argnums=(1,))
+    def update_misr(self, tpal_state, batch):
+        """Performs a parameter update."""
+        misr_params, misr_opt_state, misr_loss = self._misr_update(
+            tpal_state.params.misr,
+            tpal_state.opt_state.misr,
+            tpal_state.params.auct,
+            batch,
         )
-        misr_params = optax.apply_updates(tpal_state.params.misr, misr_update)
 
         params = TPALTuple(misr=misr_params, auct=tpal_state.params.auct)
         opt_state = TPALTuple(misr=misr_opt_state, auct=tpal_state.opt_state.auct)
@@ -383,6 +419,74 @@ class TPAL:
         }
         return tpal_state, log
 
+    @functools.partial(jax.jit, static_argnums=(0, 3), donate_argnums=(1,))
+    def train_step(self, tpal_state, batch, misr_updates):
+        """Performs misr_updates misreporter updates, then an auctioneer update."""
+
+        def misr_update_body(i, carry):
+            misr_params, misr_opt_state, misr_loss = carry
+            return self._misr_update(
+                misr_params, misr_opt_state, tpal_state.params.auct, batch
+            )
+
+        # Repeated misreporter updates, compiled once as a device loop.
+        # NOTE: only the misreporter params and optimizer state are carried,
+        # the auctioneer is constant during the loop
+        misr_params, misr_opt_state, misr_loss = jax.lax.fori_loop(
+            0,
+            misr_updates,
+            misr_update_body,
+            (tpal_state.params.misr, tpal_state.opt_state.misr, jnp.zeros(())),
+        )
+
+        params = TPALTuple(misr=misr_params, auct=tpal_state.params.auct)
+        opt_state = TPALTuple(misr=misr_opt_state, auct=tpal_state.opt_state.auct)
+        tpal_state = TPALState(params=params, opt_state=opt_state)
+
+        tpal_state, auct_log = self.update_auct(tpal_state, batch)
+
+        log = {"misr_loss": misr_loss, **auct_log}
+        return tpal_state, log
+
+
+# Run all training steps of a two player auction learner as a single compiled
+# scan. Network sizes (through tpal), the number of steps and updates and the
+# reinit schedule are static, so the compiled step is specialized to them.
+# NOTE: tpal_state is donated, don't keep references to it
+@functools.partial(jax.jit, static_argnums=(0, 4, 5, 6, 7, 8), donate_argnums=(1,))
+def train_steps(
+    tpal,
+    tpal_state,
+    rng,
+    rng_misr_reinit,
+    num_steps,
+    misr_updates,
+    misr_reinit_iv,
+    misr_reinit_lim,
+    batch_size,
+):
+    def train_step(tpal_state, key_and_step):
+        rng_sample, step = key_and_step
+
+        # Sample valuations
+        val_sample = BidSampler.sample(rng_sample, batch_size, tpal.bidders, tpal.items)
+
+        # NOTE: only the shape of the sample matters for initialization
+        tpal_state = jax.lax.cond(
+            ((step % misr_reinit_iv) == 0) & (step <= misr_reinit_lim),
+            lambda s: tpal.reinit_misr(rng_misr_reinit, s, val_sample[:1]),
+            lambda s: s,
+            tpal_state,
+        )
+
+        tpal_state, log = tpal.train_step(tpal_state, val_sample, misr_updates)
+
+        return tpal_state, log
+
+    # One sampling key per step, streamed through the scan
+    keys = jax.random.split(rng, num_steps)
+    return jax.lax.scan(train_step, tpal_state, (keys, jnp.arange(num_steps)))
+
 
 # Train a two player auction learner and return it with state.
 def training(
@@ -414,75 +518,60 @@ def training(
     rng = jax.random.PRNGKey(1729)
 
     # Initialize the network and optimizer.
-    rng, rng_sampler, rng_state_init, rng_misr_reinit = jax.random.split(rng, 4)
-
-    # Initialize BidSampler
-    sampler = BidSampler(rng_sampler, bidders, items)
-
-    tpal_state = tpal.initial_state(rng_state_init, sampler.sample(1))
-
-    steps = []
-    auct_losses = []
-    misr_losses = []
-
-    for step in range(num_steps):
-        # Sample valuations
-        val_sample = sampler.sample(batch_size)
-
-        if ((step % misr_reinit_iv) == 0) and (step <= misr_reinit_lim):
-            tpal_state = tpal.reinit_misr(
-                rng_misr_reinit, tpal_state, sampler.sample(1)
-            )
-
-        for _ in range(0, misr_updates):
-            tpal_state, misr_log = tpal.update_misr(tpal_state, val_sample)
-
-        tpal_state, auct_log = tpal.update_auct(tpal_state, val_sample)
-
-        # Log the losses.
-        if step % log_every == 0:
-            # It's important to call `device_get` here so we don't take up device
-            # memory by saving the losses.
-            misr_log = jax.device_get(misr_log)
-            auct_log = jax.device_get(auct_log)
-
-            auct_loss = auct_log["auct_loss"]
-            misr_loss = misr_log["misr_loss"]
-            print(
-                f"Step {step}: "
-                f"auct_loss = {auct_loss:.3f}, misr_loss = {misr_loss:.3f}"
-            )
-            steps.append(step)
-            auct_losses.append(auct_loss)
-            misr_losses.append(misr_loss)
+    rng, rng_state_init, rng_misr_reinit = jax.random.split(rng, 3)
+
+    # NOTE: only the shape of the valuations matters for initialization
+    tpal_state = tpal.initial_state(rng_state_init, jnp.zeros((1, bidders, items)))
+
+    print("Auctioneer: \n\n{}\n".format(tree_shape(tpal_state.params.auct)))
+    print("Misreporter: \n\n{}\n".format(tree_shape(tpal_state.params.misr)))
+
+    tpal_state, logs = train_steps(
+        tpal,
+        tpal_state,
+        rng,
+        rng_misr_reinit,
+        num_steps,
+        misr_updates,
+        misr_reinit_iv,
+        misr_reinit_lim,
+        batch_size,
+    )
+
+    # Transfer the stacked losses of all steps to the host once.
+    logs = jax.device_get(logs)
+
+    # Log the losses.
+    steps = range(0, num_steps, log_every)
+    auct_losses = logs["auct_loss"][::log_every]
+    misr_losses = logs["misr_loss"][::log_every]
+    for step, auct_loss, misr_loss in zip(steps, auct_losses, misr_losses):
+        print(f"Step {step}: auct_loss = {auct_loss:.3f}, misr_loss = {misr_loss:.3f}")
 
     return tpal, tpal_state
 
 
 def test(tpal, tpal_state):
     rng = jax.random.PRNGKey(1337)
-    sampler = BidSampler(rng, tpal.bidders, tpal.items)
 
-    for _ in range(0, 10):
-        val_sample = sampler.sample(1)
+    # Evaluate all bid profiles in one batch
+    val_sample = BidSampler.sample(rng, 10, tpal.bidders, tpal.items)
 
-        # Receive an auction
-        alloc, pay = tpal.auct_transform.apply(tpal_state.params.auct, val_sample)
+    # Receive auctions
+    alloc, pay, _ = tpal.auct_transform.apply(tpal_state.params.auct, val_sample)
 
-        # Receive misreports
-        misreports = tpal.misr_transform.apply(tpal_state.params.misr, val_sample)
+    # Receive misreports
+    misreports = tpal.misr_transform.apply(tpal_state.params.misr, val_sample)
 
-        # TODO: put the squeeze in misr_utility?
-        misr_util = tpal.misr_utility(
-            misreports, jnp.squeeze(val_sample), tpal_state.params.auct
-        )
-        truth_util = tpal.utility(val_sample, alloc, pay)
-        regret = misr_util - truth_util
+    misr_util = tpal.misr_utility(misreports, val_sample, tpal_state.params.auct)
+    truth_util = tpal.utility(val_sample, alloc, pay)
+    regret = misr_util - truth_util
 
-        print("utility truthful: " + str(jnp.sum(truth_util)))
-        print("utility misrep: " + str(jnp.sum(misr_util)))
-        print("regret: " + str(jnp.sum(regret)))
-        print("pay: " + str(jnp.sum(pay)))
+    for i in range(0, 10):
+        print("utility truthful: " + str(jnp.sum(truth_util[i])))
+        print("utility misrep: " + str(jnp.sum(misr_util[i])))
+        print("regret: " + str(jnp.sum(regret[i])))
+        print("pay: " + str(jnp.sum(pay[i])))
 
 
 # Short training, for tests